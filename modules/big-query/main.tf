@@ -21,6 +21,15 @@ resource "google_bigquery_table" "transcripts" {
 
   labels = var.labels
 
+  # Partition by day of creation so date-filtered reads only scan matching days,
+  # and cluster by id so lookups by id touch few blocks
+  time_partitioning {
+    type  = "DAY"
+    field = "created_at"
+  }
+
+  clustering = ["id"]
+
   schema = jsonencode([
     {
       name        = "id"
@@ -39,6 +48,12 @@ resource "google_bigquery_table" "transcripts" {
       type        = "STRING"
       mode        = "REQUIRED"
       description = "Content of the transcript"
+    },
+    {
+      name        = "content_length"
+      type        = "INTEGER"
+      mode        = "NULLABLE"
+      description = "Length of content in characters, precomputed at insert time"
     }
   ])
 }
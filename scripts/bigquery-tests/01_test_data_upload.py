@@ -7,69 +7,137 @@ Run as: python 01_test_data_upload.py --project-id mycompany-mlops-dev
 
 import argparse
 from datetime import datetime
+from itertools import islice
 from google.cloud import bigquery
 from google.cloud.exceptions import GoogleCloudError
+import os
 import uuid
 import sys
+from typing import Iterable, Iterator, List
 
+from bq_common import get_client
 
-def test_data_upload(project_id: str, dataset_id: str = "test_data", table_id: str = "transcripts"):
-    """Test uploading data to the transcripts table."""
+
+# Rows per load job; large inputs are split into successive load jobs
+LOAD_CHUNK_SIZE = 10_000
+
+# Mirrors the transcripts table schema in modules/big-query/main.tf
+TRANSCRIPTS_SCHEMA = [
+    bigquery.SchemaField("id", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("created_at", "DATETIME", mode="REQUIRED"),
+    bigquery.SchemaField("content", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("content_length", "INTEGER"),
+]
+
+# Demo transcripts uploaded by the test
+SAMPLE_CONTENTS = [
+    "This is a test transcript for ML training data.",
+    "Another test transcript with some technical discussion about machine learning models.",
+    "Meeting notes: Discussed the new NLP pipeline architecture and performance metrics.",
+]
+
+
+def bulk_uuid4(n: int) -> List[str]:
+    """Generate n random UUID strings from a single os.urandom call."""
+    raw = os.urandom(16 * n)
+    return [str(uuid.UUID(bytes=raw[i:i + 16], version=4)) for i in range(0, 16 * n, 16)]
+
+
+def iter_rows(ids: List[str], contents: Iterable[str]) -> Iterator[dict]:
+    """Lazily yield transcript rows sharing one creation timestamp.
+    
+    Rows are produced on demand so load jobs only hold one chunk in memory at a time.
+    """
+    
+    now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    
+    # content_length is precomputed so reads can skip scanning the content column
+    for row_id, content in zip(ids, contents):
+        yield {"id": row_id, "created_at": now, "content": content, "content_length": len(content)}
+
+
+def chunked(rows, size: int = LOAD_CHUNK_SIZE):
+    """Yield successive lists of at most `size` rows from any iterable."""
+    iterator = iter(rows)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def load_rows(client: bigquery.Client, table_ref: str, rows) -> int:
+    """Append rows to the table with batch load jobs. Returns the number of rows loaded."""
+    
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+        write_disposition="WRITE_APPEND",
+        schema=TRANSCRIPTS_SCHEMA,
+    )
+    
+    loaded = 0
+    for chunk in chunked(rows):
+        job = client.load_table_from_json(chunk, table_ref, job_config=job_config)
+        job.result()  # Wait for job to complete; raises on failure
+        loaded += len(chunk)
+    
+    return loaded
+
+
+def test_data_upload(project_id: str, dataset_id: str = "test_data", table_id: str = "transcripts",
+                     streaming: bool = False):
+    """Test uploading data to the transcripts table.
+    
+    Uses batch load jobs by default; `streaming=True` uses the insertAll streaming API instead.
+    """
     
     print(f"🔍 Testing data upload to {project_id}.{dataset_id}.{table_id}")
     print(f"📝 Current user: Check with 'gcloud auth list'\n")
     
     try:
         # Initialize BigQuery client
-        client = bigquery.Client(project=project_id)
+        client = get_client(project_id)
         
         # Prepare test data
-        test_rows = [
-            {
-                "id": str(uuid.uuid4()),
-                "created_at": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
-                "content": "This is a test transcript for ML training data."
-            },
-            {
-                "id": str(uuid.uuid4()),
-                "created_at": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
-                "content": "Another test transcript with some technical discussion about machine learning models."
-            },
-            {
-                "id": str(uuid.uuid4()),
-                "created_at": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
-                "content": "Meeting notes: Discussed the new NLP pipeline architecture and performance metrics."
-            }
-        ]
+        inserted_ids = bulk_uuid4(len(SAMPLE_CONTENTS))
+        test_rows = iter_rows(inserted_ids, SAMPLE_CONTENTS)
         
         # Construct table reference
         table_ref = f"{project_id}.{dataset_id}.{table_id}"
         
-        print(f"📤 Attempting to insert {len(test_rows)} rows...")
+        if streaming:
+            print(f"📤 Attempting to stream {len(inserted_ids)} rows...")
+            errors = client.insert_rows_json(table_ref, list(test_rows))
+            if errors:
+                print("❌ FAILED: Errors occurred during insert:")
+                for error in errors:
+                    print(f"   - {error}")
+                return False
+            uploaded = len(inserted_ids)
+        else:
+            # Load jobs raise on failure, which is reported by the handlers below
+            print(f"📤 Attempting to load {len(inserted_ids)} rows...")
+            uploaded = load_rows(client, table_ref, test_rows)
+        
+        print("✅ SUCCESS: Data uploaded successfully!")
+        print(f"   Inserted {uploaded} rows to {table_ref}")
         
-        # Insert rows
-        errors = client.insert_rows_json(table_ref, test_rows)
+        # Verify by reading back only the inserted ids (pruned by partition and id clustering)
+        query = f"""
+        SELECT COUNT(*) as row_count 
+        FROM `{table_ref}`
+        WHERE DATE(created_at) = CURRENT_DATE()
+          AND id IN UNNEST(@inserted_ids)
+        """
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ArrayQueryParameter("inserted_ids", "STRING", inserted_ids)
+            ]
+        )
+        
+        result = list(client.query_and_wait(query, job_config=job_config))
+        print(f"   Verified: {result[0].row_count} of {uploaded} inserted rows found")
         
-        if not errors:
-            print("✅ SUCCESS: Data uploaded successfully!")
-            print(f"   Inserted {len(test_rows)} rows to {table_ref}")
-            
-            # Verify by reading back
-            query = f"""
-            SELECT COUNT(*) as row_count 
-            FROM `{table_ref}`
-            WHERE DATE(created_at) = CURRENT_DATE()
-            """
-            
-            result = list(client.query(query))
-            print(f"   Verified: {result[0].row_count} rows inserted today")
-            
-        else:
-            print("❌ FAILED: Errors occurred during insert:")
-            for error in errors:
-                print(f"   - {error}")
-            return False
-            
     except GoogleCloudError as e:
         print(f"❌ FAILED: Google Cloud Error")
         print(f"   Error: {e}")
@@ -92,6 +160,8 @@ def main():
     parser.add_argument("--project-id", required=True, help="GCP Project ID")
     parser.add_argument("--dataset-id", default="test_data", help="BigQuery dataset ID")
     parser.add_argument("--table-id", default="transcripts", help="BigQuery table ID")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Use the streaming insert API instead of a batch load job")
     
     args = parser.parse_args()
     
@@ -99,7 +169,7 @@ def main():
     print("BigQuery Access Test: Data Upload (WRITER)")
     print("=" * 60)
     
-    success = test_data_upload(args.project_id, args.dataset_id, args.table_id)
+    success = test_data_upload(args.project_id, args.dataset_id, args.table_id, args.streaming)
     
     print("\n" + "=" * 60)
     if success:
@@ -6,11 +6,13 @@ Run as: python 02_test_data_read.py --project-id mycompany-mlops-dev
 """
 
 import argparse
-from google.cloud import bigquery
+from concurrent.futures import ThreadPoolExecutor
 from google.cloud.exceptions import GoogleCloudError
-import pandas as pd
 import sys
 
+from bq_cache import get_table_cached
+from bq_common import get_client, print_rows
+
 
 def test_data_read(project_id: str, dataset_id: str = "test_data", table_id: str = "transcripts"):
     """Test reading data from the transcripts table."""
@@ -20,52 +22,65 @@ def test_data_read(project_id: str, dataset_id: str = "test_data", table_id: str
     
     try:
         # Initialize BigQuery client
-        client = bigquery.Client(project=project_id)
+        client = get_client(project_id)
         
         table_ref = f"{project_id}.{dataset_id}.{table_id}"
         
         # Test 1: Basic SELECT query
-        print("📖 Test 1: Basic SELECT query...")
         query = f"""
         SELECT 
             id,
             created_at,
-            LENGTH(content) as content_length,
+            content_length,
             SUBSTR(content, 1, 50) as content_preview
         FROM `{table_ref}`
+        WHERE created_at >= DATETIME_SUB(CURRENT_DATETIME(), INTERVAL 7 DAY)
         LIMIT 5
         """
         
-        df = client.query(query).to_dataframe()
-        print(f"✅ SUCCESS: Retrieved {len(df)} rows")
-        if not df.empty:
-            print("\nSample data:")
-            print(df.to_string())
-        
         # Test 2: Aggregation query
-        print("\n📊 Test 2: Aggregation query...")
         agg_query = f"""
         SELECT 
             DATE(created_at) as date,
             COUNT(*) as transcript_count,
-            AVG(LENGTH(content)) as avg_content_length,
+            AVG(content_length) as avg_content_length,  -- Reads only content_length, not content
             MIN(created_at) as earliest_transcript,
             MAX(created_at) as latest_transcript
         FROM `{table_ref}`
+        WHERE created_at >= DATETIME_SUB(CURRENT_DATETIME(), INTERVAL 7 DAY)
         GROUP BY date
         ORDER BY date DESC
         LIMIT 7
         """
         
-        agg_df = client.query(agg_query).to_dataframe()
-        print(f"✅ SUCCESS: Retrieved {len(agg_df)} aggregated rows")
-        if not agg_df.empty:
-            print("\nDaily statistics:")
-            print(agg_df.to_string())
+        # The three tests are independent, so run them concurrently and report in order
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            select_future = executor.submit(
+                lambda: list(client.query_and_wait(query))
+            )
+            agg_future = executor.submit(
+                lambda: list(client.query_and_wait(agg_query))
+            )
+            table_future = executor.submit(get_table_cached, client, table_ref)
+            
+            print("📖 Test 1: Basic SELECT query...")
+            rows = select_future.result()
+            print(f"✅ SUCCESS: Retrieved {len(rows)} rows")
+            if rows:
+                print("\nSample data:")
+                print_rows(rows)
+            
+            print("\n📊 Test 2: Aggregation query...")
+            agg_rows = agg_future.result()
+            print(f"✅ SUCCESS: Retrieved {len(agg_rows)} aggregated rows")
+            if agg_rows:
+                print("\nDaily statistics:")
+                print_rows(agg_rows)
+            
+            # Test 3: Check table metadata
+            print("\n🔧 Test 3: Table metadata access...")
+            table = table_future.result()
         
-        # Test 3: Check table metadata
-        print("\n🔧 Test 3: Table metadata access...")
-        table = client.get_table(table_ref)
         print(f"✅ SUCCESS: Retrieved table metadata")
         print(f"   - Table size: {table.num_rows} rows, {table.num_bytes / 1024:.2f} KB")
         print(f"   - Created: {table.created}")
@@ -95,7 +110,7 @@ def test_write_attempt(project_id: str, dataset_id: str = "test_data", table_id:
     print(f"\n🚫 Test 4: Attempting write operation (testing read-only access)...")
     
     try:
-        client = bigquery.Client(project=project_id)
+        client = get_client(project_id)
         table_ref = f"{project_id}.{dataset_id}.{table_id}"
         
         # Try to delete (this should fail for read-only users)
@@ -104,7 +119,7 @@ def test_write_attempt(project_id: str, dataset_id: str = "test_data", table_id:
         WHERE id = 'test-delete-attempt'
         """
         
-        client.query(delete_query).result()
+        client.query_and_wait(delete_query)
         print("⚠️  WARNING: Write operation succeeded - user has WRITER access!")
         return True
         
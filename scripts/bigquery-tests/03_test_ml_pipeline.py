@@ -9,39 +9,134 @@ import argparse
 from datetime import datetime, timedelta
 from google.cloud import bigquery
 from google.cloud.exceptions import GoogleCloudError
-import pandas as pd
-import numpy as np
+from google.api_core.exceptions import PermissionDenied
+import functools
+import io
 import sys
 import json
+from typing import TYPE_CHECKING
 
+from bq_common import get_bqstorage_client, get_client, print_rows
 
-def simulate_ml_processing(df: pd.DataFrame) -> pd.DataFrame:
+# pandas, numpy and pyarrow are imported inside the functions that use them, so
+# starting the script (or importing it as a library) doesn't pay their import cost
+if TYPE_CHECKING:
+    import pandas as pd
+    import pyarrow as pa
+
+
+# Schema for the processed table
+PROCESSED_SCHEMA = [
+    bigquery.SchemaField("id", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("created_at", "DATETIME", mode="REQUIRED"),
+    bigquery.SchemaField("content", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("word_count", "INTEGER"),
+    bigquery.SchemaField("char_count", "INTEGER"),
+    bigquery.SchemaField("avg_word_length", "FLOAT"),
+    bigquery.SchemaField("sentiment_score", "FLOAT"),
+    bigquery.SchemaField("topic_confidence", "FLOAT"),
+    bigquery.SchemaField("predicted_topic", "STRING"),
+    bigquery.SchemaField("processing_timestamp", "DATETIME"),
+]
+
+TOPICS = ('technical', 'business', 'general', 'support')
+
+
+def processed_arrow_schema() -> "pa.Schema":
+    """Arrow types matching PROCESSED_SCHEMA; naive timestamps load into DATETIME columns."""
+    import pyarrow as pa
+    
+    return pa.schema([
+        pa.field("id", pa.string(), nullable=False),
+        pa.field("created_at", pa.timestamp("us"), nullable=False),
+        pa.field("content", pa.string(), nullable=False),
+        pa.field("word_count", pa.int64()),
+        pa.field("char_count", pa.int64()),
+        pa.field("avg_word_length", pa.float64()),
+        pa.field("sentiment_score", pa.float64()),
+        pa.field("topic_confidence", pa.float64()),
+        pa.field("predicted_topic", pa.string()),
+        pa.field("processing_timestamp", pa.timestamp("us")),
+    ])
+
+
+@functools.lru_cache(maxsize=None)
+def _get_rng():
+    """Shared generator for simulated model outputs (PCG64, independent of numpy's global state)."""
+    import numpy as np
+    return np.random.default_rng()
+
+
+def simulate_ml_processing(df: "pd.DataFrame") -> "pd.DataFrame":
     """Simulate ML processing on transcript data."""
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
     
-    # Simulate some ML features
-    df['word_count'] = df['content'].str.split().str.len()
-    df['char_count'] = df['content'].str.len()
-    df['avg_word_length'] = df['char_count'] / df['word_count']
-    df['sentiment_score'] = np.random.uniform(-1, 1, len(df))  # Simulated sentiment
-    df['topic_confidence'] = np.random.uniform(0.5, 1.0, len(df))  # Simulated topic model
+    # Simulate some ML features with Arrow compute kernels (strings stay in Arrow buffers)
+    content = pa.array(df['content'], type=pa.string())
+    char_count = pc.utf8_length(content)
+    word_count = pc.add(pc.count_substring(content, " "), 1)  # Approximate: single-space separated
+    avg_word_length = pc.divide(pc.cast(char_count, pa.float64()), pc.cast(word_count, pa.float64()))
+    df = df.assign(
+        word_count=word_count.to_numpy(),
+        char_count=char_count.to_numpy(),
+        avg_word_length=avg_word_length.to_numpy(),
+    )
+    rng = _get_rng()
+    n = len(df)
+    df['sentiment_score'] = rng.uniform(-1, 1, n)  # Simulated sentiment
+    df['topic_confidence'] = rng.uniform(0.5, 1.0, n)  # Simulated topic model
     df['processing_timestamp'] = datetime.utcnow()
     
     # Simulate topic classification
-    topics = ['technical', 'business', 'general', 'support']
-    df['predicted_topic'] = np.random.choice(topics, len(df))
+    df['predicted_topic'] = np.asarray(TOPICS)[rng.integers(0, len(TOPICS), n)]
     
     return df
 
 
+def _iter_result_chunks(job: bigquery.QueryJob):
+    """Yield query results as DataFrame chunks, via the Storage API when permitted.
+    
+    The Storage API needs bigquery.readsessions.create on the project, which the
+    ml-pipeline service account (jobUser + dataset dataEditor) doesn't have; in that
+    case the chunks are paged over REST instead.
+    """
+    chunks = job.result().to_dataframe_iterable(bqstorage_client=get_bqstorage_client())
+    try:
+        # The read session is created when the first chunk is requested
+        first = next(chunks, None)
+    except PermissionDenied:
+        print("ℹ️  No permission to create Storage API read sessions; reading results over REST")
+        yield from job.result().to_dataframe_iterable()
+        return
+    
+    if first is not None:
+        yield first
+        yield from chunks
+
+
+def _write_processed_chunk(writer, arrow_schema: "pa.Schema", chunk: "pd.DataFrame") -> "pd.DataFrame":
+    """Run one chunk through the ML pipeline and append it to the Parquet writer."""
+    import pyarrow as pa
+    
+    processed = simulate_ml_processing(chunk)
+    writer.write_table(pa.Table.from_pandas(processed, schema=arrow_schema, preserve_index=False))
+    return processed
+
+
 def test_ml_pipeline(project_id: str, dataset_id: str = "test_data"):
     """Test ML pipeline operations: read, process, and write back."""
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
     
     print(f"🤖 Testing ML pipeline access for {project_id}.{dataset_id}")
     print(f"📝 Current identity: Check with 'gcloud auth list'\n")
     
     try:
         # Initialize BigQuery client
-        client = bigquery.Client(project=project_id)
+        client = get_client(project_id)
         
         source_table = f"{project_id}.{dataset_id}.transcripts"
         processed_table = f"{project_id}.{dataset_id}.transcripts_processed"
@@ -54,63 +149,78 @@ def test_ml_pipeline(project_id: str, dataset_id: str = "test_data"):
             created_at,
             content
         FROM `{source_table}`
+        -- Filter on the partitioning column so only the last 30 daily partitions are scanned
         WHERE created_at >= DATETIME_SUB(CURRENT_DATETIME(), INTERVAL 30 DAY)
         """
         
-        df = client.query(read_query).to_dataframe()
-        print(f"✅ Retrieved {len(df)} transcripts for processing")
-        
-        if df.empty:
-            print("⚠️  No data to process. Generating sample data...")
-            # Create sample data for testing
-            df = pd.DataFrame({
-                'id': [f'ml-test-{i}' for i in range(5)],
-                'created_at': [datetime.utcnow() - timedelta(days=i) for i in range(5)],
-                'content': [
-                    "Technical discussion about neural networks and deep learning.",
-                    "Business meeting notes on Q4 revenue projections.",
-                    "General team standup discussing project timelines.",
-                    "Customer support ticket regarding login issues.",
-                    "Technical deep dive into transformer architecture."
-                ]
-            })
-        
-        # Step 2: Process data (simulate ML pipeline)
+        # Stream results as chunks instead of materializing them at once
+        chunks = _iter_result_chunks(client.query(read_query))
+        
+        # Step 2: Process data (simulate ML pipeline) chunk by chunk. Each processed
+        # chunk is written straight into an in-memory Parquet file and then dropped,
+        # so only one chunk is held as a DataFrame at a time.
         print("\n🔬 Step 2: Processing transcripts through ML pipeline...")
-        processed_df = simulate_ml_processing(df)
-        print(f"✅ Processed {len(processed_df)} transcripts")
+        arrow_schema = processed_arrow_schema()
+        sink = pa.BufferOutputStream()
+        sample_columns = ['id', 'predicted_topic', 'sentiment_score', 'word_count']
+        sample_rows = None
+        processed_count = 0
+        chunk_count = 0
+        
+        with pq.ParquetWriter(sink, arrow_schema, compression="snappy") as writer:
+            for chunk in chunks:
+                if chunk.empty:
+                    continue
+                processed = _write_processed_chunk(writer, arrow_schema, chunk)
+                if sample_rows is None:
+                    sample_rows = processed[sample_columns].head().to_dict('records')
+                processed_count += len(processed)
+                chunk_count += 1
+            print(f"✅ Retrieved {processed_count} transcripts in {chunk_count} chunks")
+            
+            if processed_count == 0:
+                print("⚠️  No data to process. Generating sample data...")
+                # Create sample data for testing
+                df = pd.DataFrame({
+                    'id': [f'ml-test-{i}' for i in range(5)],
+                    'created_at': [datetime.utcnow() - timedelta(days=i) for i in range(5)],
+                    'content': [
+                        "Technical discussion about neural networks and deep learning.",
+                        "Business meeting notes on Q4 revenue projections.",
+                        "General team standup discussing project timelines.",
+                        "Customer support ticket regarding login issues.",
+                        "Technical deep dive into transformer architecture."
+                    ]
+                })
+                processed = _write_processed_chunk(writer, arrow_schema, df)
+                sample_rows = processed[sample_columns].head().to_dict('records')
+                processed_count += len(processed)
+        
+        print(f"✅ Processed {processed_count} transcripts")
         print("\nSample processed data:")
-        print(processed_df[['id', 'predicted_topic', 'sentiment_score', 'word_count']].head())
+        print_rows(sample_rows)
         
         # Step 3: Write results back to BigQuery
         print(f"\n📤 Step 3: Writing processed results to {processed_table}...")
         
-        # Define schema for processed table
+        # Hand the compressed Parquet bytes to the load job as a file object
+        buf = io.BytesIO(sink.getvalue().to_pybytes())
+        
         job_config = bigquery.LoadJobConfig(
-            schema=[
-                bigquery.SchemaField("id", "STRING", mode="REQUIRED"),
-                bigquery.SchemaField("created_at", "DATETIME", mode="REQUIRED"),
-                bigquery.SchemaField("content", "STRING", mode="REQUIRED"),
-                bigquery.SchemaField("word_count", "INTEGER"),
-                bigquery.SchemaField("char_count", "INTEGER"),
-                bigquery.SchemaField("avg_word_length", "FLOAT"),
-                bigquery.SchemaField("sentiment_score", "FLOAT"),
-                bigquery.SchemaField("topic_confidence", "FLOAT"),
-                bigquery.SchemaField("predicted_topic", "STRING"),
-                bigquery.SchemaField("processing_timestamp", "DATETIME"),
-            ],
+            source_format=bigquery.SourceFormat.PARQUET,
+            schema=PROCESSED_SCHEMA,
             write_disposition="WRITE_TRUNCATE",  # Replace table contents
         )
         
         # Load data to BigQuery
-        job = client.load_table_from_dataframe(
-            processed_df, 
+        job = client.load_table_from_file(
+            buf, 
             processed_table, 
             job_config=job_config
         )
         job.result()  # Wait for job to complete
         
-        print(f"✅ Successfully wrote {len(processed_df)} processed records")
+        print(f"✅ Successfully wrote {processed_count} processed records")
         
         # Step 4: Verify and summarize
         print("\n📊 Step 4: Generating processing summary...")
@@ -125,9 +235,9 @@ def test_ml_pipeline(project_id: str, dataset_id: str = "test_data"):
         ORDER BY count DESC
         """
         
-        summary_df = client.query(summary_query).to_dataframe()
+        summary_rows = list(client.query_and_wait(summary_query))
         print("\nProcessing Summary by Topic:")
-        print(summary_df.to_string())
+        print_rows(summary_rows)
         
         return True
         
@@ -156,7 +266,7 @@ def test_pipeline_monitoring(project_id: str, dataset_id: str = "test_data"):
     print(f"\n📈 Testing pipeline monitoring capabilities...")
     
     try:
-        client = bigquery.Client(project=project_id)
+        client = get_client(project_id)
         
         # Check processing history
         monitor_query = f"""
@@ -172,11 +282,11 @@ def test_pipeline_monitoring(project_id: str, dataset_id: str = "test_data"):
         ORDER BY process_date DESC
         """
         
-        monitor_df = client.query(monitor_query).to_dataframe()
+        monitor_rows = list(client.query_and_wait(monitor_query))
         
-        if not monitor_df.empty:
+        if monitor_rows:
             print("✅ Pipeline monitoring data available:")
-            print(monitor_df.to_string())
+            print_rows(monitor_rows)
         else:
             print("ℹ️  No recent processing history found")
             
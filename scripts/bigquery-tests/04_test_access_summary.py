@@ -6,15 +6,165 @@ Run as: python 04_test_access_summary.py --project-id mycompany-mlops-dev
 """
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from google.cloud import bigquery
 from google.api_core import exceptions
 import sys
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
+import hashlib
 import json
+import time
+from pathlib import Path
 
+from bq_cache import get_dataset_cached
+from bq_common import get_client
 
-def check_dataset_permissions(client: bigquery.Client, project_id: str, dataset_id: str) -> Dict[str, bool]:
-    """Check various permissions on the dataset."""
+
+# Probe results are reused across runs for the same identity and dataset
+PERMISSION_CACHE_FILE = Path.home() / ".cache" / "mlops-bq-tests" / "permission_probes.json"
+PERMISSION_CACHE_TTL_SECONDS = 300
+
+_permission_cache: Dict[str, dict] = {}
+
+
+def _id_token_subject(credentials) -> Optional[str]:
+    """Return the email (or sub) claim of the credentials' ID token, if it has one."""
+    
+    id_token = getattr(credentials, 'id_token', None)
+    if not id_token:
+        return None
+    try:
+        from google.auth import jwt
+        claims = jwt.decode(id_token, verify=False)
+    except ValueError:
+        return None
+    return claims.get('email') or claims.get('sub')
+
+
+def _credentials_fingerprint(client: bigquery.Client) -> Optional[str]:
+    """Return a short, non-reversible fingerprint of the client's identity.
+    
+    Returns None when no identity can be determined (e.g. external-account
+    credentials without impersonation), in which case results aren't cached.
+    """
+    
+    credentials = client._credentials
+    identity = (
+        getattr(credentials, 'service_account_email', None)
+        or getattr(credentials, '_service_account_email', None)
+        or _id_token_subject(credentials)
+        or getattr(credentials, 'refresh_token', None)
+    )
+    if not identity:
+        return None
+    return hashlib.sha256(str(identity).encode()).hexdigest()[:16]
+
+
+def _load_cached_permissions(key: str) -> Optional[Dict[str, bool]]:
+    """Return cached probe results for `key` if they are younger than the TTL."""
+    
+    entry = _permission_cache.get(key)
+    if entry is None:
+        try:
+            entry = json.loads(PERMISSION_CACHE_FILE.read_text()).get(key)
+        except (OSError, ValueError):
+            entry = None
+    
+    if entry and time.time() - entry['checked_at'] < PERMISSION_CACHE_TTL_SECONDS:
+        _permission_cache[key] = entry
+        return entry['permissions']
+    return None
+
+
+def _save_cached_permissions(key: str, permissions: Dict[str, bool]) -> None:
+    """Store probe results in memory and in the on-disk cache file."""
+    
+    entry = {'checked_at': time.time(), 'permissions': permissions}
+    _permission_cache[key] = entry
+    try:
+        cache = json.loads(PERMISSION_CACHE_FILE.read_text())
+    except (OSError, ValueError):
+        cache = {}
+    cache[key] = entry
+    try:
+        PERMISSION_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        PERMISSION_CACHE_FILE.write_text(json.dumps(cache))
+    except OSError:
+        pass  # Caching is best-effort
+
+
+def _is_access_denied(exc: exceptions.Forbidden) -> bool:
+    """Whether a 403 is a real permission denial.
+    
+    BigQuery also returns 403 for rateLimitExceeded / quotaExceeded, which are
+    failures to check rather than answers.
+    """
+    return any(error.get('reason') == 'accessDenied' for error in (exc.errors or []))
+
+
+def _can_list_tables(client: bigquery.Client, dataset_ref: str) -> bool:
+    """Probe: list tables in the dataset. Errors other than an access denial propagate."""
+    try:
+        list(client.list_tables(dataset_ref))
+        return True
+    except exceptions.Forbidden as e:
+        if _is_access_denied(e):
+            return False
+        raise
+
+
+# Table-level IAM permissions tested on the transcripts table. BigQuery exposes
+# testIamPermissions on tables (not datasets), so dataset roles are inferred from
+# the permissions they grant on tables inside the dataset:
+#   dataViewer -> tables.get, tables.getData
+#   dataEditor -> + tables.updateData, tables.delete
+#   dataOwner  -> + tables.setIamPolicy
+IAM_PERMISSIONS_TO_TEST = [
+    "bigquery.tables.get",
+    "bigquery.tables.getData",
+    "bigquery.tables.updateData",
+    "bigquery.tables.delete",
+    "bigquery.tables.setIamPolicy",
+]
+
+
+# Permission keys that are inferred from predefined-role grants rather than tested
+# directly; custom roles may grant one without the other
+INFERRED_PERMISSIONS = {'can_create_table', 'can_update_dataset'}
+
+
+def _granted_table_permissions(client: bigquery.Client, dataset_ref: str) -> Optional[List[str]]:
+    """Return which IAM_PERMISSIONS_TO_TEST the caller holds on the transcripts table.
+    
+    Returns None when the transcripts table doesn't exist, so the permissions are
+    unknown rather than denied. Other errors propagate, including 403s: the call
+    reports denials by leaving permissions out of the response, so a 403 means
+    the check itself failed (e.g. rateLimitExceeded).
+    """
+    try:
+        response = client.test_iam_permissions(f"{dataset_ref}.transcripts", IAM_PERMISSIONS_TO_TEST)
+        return response.get("permissions", [])
+    except exceptions.NotFound:
+        return None
+
+
+def check_dataset_permissions(client: bigquery.Client, project_id: str, dataset_id: str,
+                              use_cache: bool = True) -> Dict[str, Optional[bool]]:
+    """Check various permissions on the dataset.
+    
+    Data permissions are None (unknown) when the transcripts table is missing.
+    Results are cached per identity and dataset for PERMISSION_CACHE_TTL_SECONDS,
+    but only when every check got a real answer (not a rate-limit or other
+    failure); pass `use_cache=False` to force the probes to run again.
+    """
+    
+    fingerprint = _credentials_fingerprint(client)
+    cache_key = f"{project_id}.{dataset_id}:{fingerprint}" if fingerprint else None
+    if use_cache and cache_key:
+        cached = _load_cached_permissions(cache_key)
+        if cached is not None:
+            print(f"   (cached results, re-run with --no-cache to re-probe)")
+            return cached
     
     permissions = {
         'dataset_exists': False,
@@ -31,60 +181,43 @@ def check_dataset_permissions(client: bigquery.Client, project_id: str, dataset_
     
     # Check if dataset exists and is accessible
     try:
-        dataset = client.get_dataset(dataset_ref)
+        get_dataset_cached(client, dataset_ref)
         permissions['dataset_exists'] = True
         permissions['can_get_dataset'] = True
     except exceptions.NotFound:
         print(f"❌ Dataset {dataset_ref} not found")
         return permissions
-    except exceptions.Forbidden:
+    except exceptions.Forbidden as e:
+        if not _is_access_denied(e):
+            raise
         print(f"❌ No access to dataset {dataset_ref}")
         return permissions
     
-    # Check table listing
-    try:
-        tables = list(client.list_tables(dataset_ref))
-        permissions['can_list_tables'] = True
-    except:
-        pass
-    
-    # Check data read
-    try:
-        query = f"SELECT 1 FROM `{dataset_ref}.transcripts` LIMIT 1"
-        list(client.query(query))
-        permissions['can_read_data'] = True
-    except:
-        pass
+    # The remaining checks are independent, so issue them concurrently. One
+    # testIamPermissions call replaces running probe queries and DML.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        list_future = executor.submit(_can_list_tables, client, dataset_ref)
+        granted_future = executor.submit(_granted_table_permissions, client, dataset_ref)
+        permissions['can_list_tables'] = list_future.result()
+        granted = granted_future.result()
     
-    # Check data write
-    try:
-        test_table = f"{dataset_ref}.access_test_temp"
-        query = f"CREATE OR REPLACE TABLE `{test_table}` AS SELECT 'test' as data"
-        client.query(query).result()
-        permissions['can_create_table'] = True
-        permissions['can_write_data'] = True
-        
-        # Clean up
-        client.delete_table(test_table, not_found_ok=True)
-    except:
-        pass
-    
-    # Check data delete
-    try:
-        query = f"DELETE FROM `{dataset_ref}.transcripts` WHERE id = 'nonexistent-test-id'"
-        client.query(query).result()
-        permissions['can_delete_data'] = True
-    except:
-        pass
+    if granted is None:
+        print(f"⚠️  Table {dataset_ref}.transcripts not found; data permissions are unknown")
+        for perm in ('can_read_data', 'can_write_data', 'can_delete_data',
+                     'can_create_table', 'can_update_dataset'):
+            permissions[perm] = None
+        return permissions
     
-    # Check dataset update
-    try:
-        dataset.description = dataset.description  # No actual change
-        client.update_dataset(dataset, ["description"])
-        permissions['can_update_dataset'] = True
-    except:
-        pass
+    permissions['can_read_data'] = "bigquery.tables.getData" in granted
+    permissions['can_write_data'] = "bigquery.tables.updateData" in granted
+    permissions['can_delete_data'] = permissions['can_write_data']  # DML DELETE requires write (updateData)
+    permissions['can_create_table'] = "bigquery.tables.delete" in granted
+    permissions['can_update_dataset'] = "bigquery.tables.setIamPolicy" in granted
     
+    # Only cache real answers: every value must come from a successful IAM response
+    # or an accessDenied denial. Failed checks raise above and are never stored.
+    if cache_key and all(isinstance(value, bool) for value in permissions.values()):
+        _save_cached_permissions(cache_key, permissions)
     return permissions
 
 
@@ -130,13 +263,13 @@ def check_iam_roles(client: bigquery.Client, project_id: str) -> List[str]:
     return roles
 
 
-def generate_access_report(project_id: str, dataset_id: str = "test_data"):
+def generate_access_report(project_id: str, dataset_id: str = "test_data", use_cache: bool = True):
     """Generate a comprehensive access report."""
     
     print(f"🔍 Generating access report for {project_id}.{dataset_id}")
     print("=" * 60)
     
-    client = bigquery.Client(project=project_id)
+    client = get_client(project_id)
     
     # Get user info
     auth_type, identity = get_current_user_info(client)
@@ -146,16 +279,22 @@ def generate_access_report(project_id: str, dataset_id: str = "test_data"):
     
     # Check permissions
     print(f"\n🔐 Permission Check Results:")
-    permissions = check_dataset_permissions(client, project_id, dataset_id)
+    permissions = check_dataset_permissions(client, project_id, dataset_id, use_cache)
     
     for perm, has_access in permissions.items():
-        status = "✅" if has_access else "❌"
+        status = "❔" if has_access is None else "✅" if has_access else "❌"
         perm_display = perm.replace('_', ' ').title()
+        if perm in INFERRED_PERMISSIONS:
+            perm_display += " (inferred)"
         print(f"   {status} {perm_display}")
+    print(f"   (inferred = derived from table permissions of predefined roles; may differ for custom roles)")
     
     # Determine access level
     print(f"\n📊 Access Level Summary:")
-    if permissions['can_update_dataset'] and permissions['can_delete_data']:
+    if permissions['dataset_exists'] and permissions['can_read_data'] is None:
+        access_level = "UNKNOWN"
+        print(f"   ❔ Dataset is accessible, but data permissions could not be checked")
+    elif permissions['can_update_dataset'] and permissions['can_delete_data']:
         access_level = "OWNER"
         print(f"   🔑 You have OWNER access (full control)")
     elif permissions['can_write_data'] and permissions['can_create_table']:
@@ -170,7 +309,10 @@ def generate_access_report(project_id: str, dataset_id: str = "test_data"):
     
     # Recommendations
     print(f"\n💡 Recommendations:")
-    if access_level == "NONE":
+    if access_level == "UNKNOWN":
+        print(f"   - The transcripts table is missing: create it with just apply dev")
+        print(f"   - Re-run this report once the table exists")
+    elif access_level == "NONE":
         print(f"   1. Ensure the dataset exists: just apply dev")
         print(f"   2. Request access from admin: add your email/group to dataset_access in main.tf")
         print(f"   3. Check if you're authenticated: gcloud auth list")
@@ -193,8 +335,8 @@ def generate_access_report(project_id: str, dataset_id: str = "test_data"):
         
         if permissions['can_write_data']:
             print(f"\n-- Insert new transcript:")
-            print(f"INSERT INTO `{project_id}.{dataset_id}.transcripts`")
-            print(f"VALUES ('id123', CURRENT_DATETIME(), 'Your content here')")
+            print(f"INSERT INTO `{project_id}.{dataset_id}.transcripts` (id, created_at, content, content_length)")
+            print(f"VALUES ('id123', CURRENT_DATETIME(), 'Your content here', LENGTH('Your content here'))")
             
             print(f"\n-- Create new table:")
             print(f"CREATE TABLE `{project_id}.{dataset_id}.your_table`")
@@ -208,6 +350,7 @@ def main():
     parser.add_argument("--project-id", required=True, help="GCP Project ID")
     parser.add_argument("--dataset-id", default="test_data", help="BigQuery dataset ID")
     parser.add_argument("--json", action="store_true", help="Output results as JSON")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore cached permission probe results")
     
     args = parser.parse_args()
     
@@ -216,7 +359,7 @@ def main():
     print("=" * 60)
     
     try:
-        has_access = generate_access_report(args.project_id, args.dataset_id)
+        has_access = generate_access_report(args.project_id, args.dataset_id, not args.no_cache)
         return 0 if has_access else 1
     except Exception as e:
         print(f"\n❌ Failed to generate report: {e}")
@@ -0,0 +1,59 @@
+"""
+Shared helper: cached BigQuery metadata lookups.
+Wraps client.get_table / client.get_dataset in a thread-safe TTL cache so repeated
+lookups within a run skip the tables.get / datasets.get round-trip.
+"""
+
+import threading
+from typing import Callable, TypeVar
+from cachetools import TTLCache
+from google.cloud import bigquery
+
+
+CACHE_MAXSIZE = 1024
+CACHE_TTL_SECONDS = 300
+
+# The library's retry policy (transport errors, 5xx, rateLimitExceeded/backendError),
+# capped so a lookup never retries for more than a minute
+_METADATA_RETRY = bigquery.DEFAULT_RETRY.with_deadline(60)
+
+_table_cache = TTLCache(maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL_SECONDS)
+_dataset_cache = TTLCache(maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL_SECONDS)
+_cache_lock = threading.RLock()
+
+T = TypeVar("T")
+
+
+def _get_table_uncached(client: bigquery.Client, ref: str) -> bigquery.Table:
+    """Fetch table metadata from the API."""
+    return client.get_table(ref, retry=_METADATA_RETRY)
+
+
+def _get_dataset_uncached(client: bigquery.Client, ref: str) -> bigquery.Dataset:
+    """Fetch dataset metadata from the API."""
+    return client.get_dataset(ref, retry=_METADATA_RETRY)
+
+
+def _cached(cache: TTLCache, key: tuple, fetch: Callable[[], T]) -> T:
+    """Return cache[key], calling fetch() and storing its result on a miss."""
+
+    with _cache_lock:
+        if key in cache:
+            return cache[key]
+
+    # Fetch outside the lock so misses in other threads aren't serialized behind
+    # this RPC; a duplicate fetch on a race is harmless
+    value = fetch()
+    with _cache_lock:
+        cache[key] = value
+    return value
+
+
+def get_table_cached(client: bigquery.Client, ref: str) -> bigquery.Table:
+    """Return table metadata, served from cache for up to CACHE_TTL_SECONDS."""
+    return _cached(_table_cache, (client.project, str(ref)), lambda: _get_table_uncached(client, ref))
+
+
+def get_dataset_cached(client: bigquery.Client, ref: str) -> bigquery.Dataset:
+    """Return dataset metadata, served from cache for up to CACHE_TTL_SECONDS."""
+    return _cached(_dataset_cache, (client.project, str(ref)), lambda: _get_dataset_uncached(client, ref))
@@ -0,0 +1,50 @@
+"""
+Shared helper: BigQuery client reuse.
+Client construction resolves credentials and opens HTTPS connection pools, so each
+process builds one client per project and every test function reuses it.
+Also holds small output helpers shared by the test scripts.
+"""
+
+import functools
+from google.cloud import bigquery
+from typing import Mapping, Sequence
+
+
+# Upper bound on rows formatted by print_rows, so output cost stays constant
+MAX_PRINT_ROWS = 20
+
+# Guard against runaway scans; queries that would bill more than this fail instead
+MAXIMUM_BYTES_BILLED = 10_000_000_000
+
+
+@functools.lru_cache(maxsize=None)
+def get_client(project_id: str) -> bigquery.Client:
+    """Return the shared BigQuery client for a project.
+    
+    Queries default to using BigQuery's results cache, so repeated identical
+    verification and monitoring queries are served without re-running.
+    """
+    default_query_job_config = bigquery.QueryJobConfig(
+        use_query_cache=True,
+        maximum_bytes_billed=MAXIMUM_BYTES_BILLED,
+    )
+    return bigquery.Client(project=project_id, default_query_job_config=default_query_job_config)
+
+
+@functools.lru_cache(maxsize=None)
+def get_bqstorage_client():
+    """Return the shared BigQuery Storage Read API client."""
+    from google.cloud import bigquery_storage
+    return bigquery_storage.BigQueryReadClient()
+
+
+def print_rows(rows: Sequence[Mapping], max_rows: int = MAX_PRINT_ROWS) -> None:
+    """Print query result rows (or dicts) as a table, formatting at most `max_rows`."""
+    # Imported here so scripts that never print a table don't need tabulate installed
+    from tabulate import tabulate
+    
+    if not rows:
+        return
+    print(tabulate([dict(row.items()) for row in rows[:max_rows]], headers="keys", tablefmt="github"))
+    if len(rows) > max_rows:
+        print(f"... {len(rows) - max_rows} more rows")